@@ -1,8 +1,11 @@
 import os
+from functools import lru_cache
 
-import requests
+import orjson
 from dotenv import load_dotenv
 
+from .session import SESSION
+
 load_dotenv()
 
 ETHERSCAN_API_KEY = os.getenv("ETHERSCAN_API_KEY")
@@ -11,6 +14,8 @@ POLYGON_API_KEY = os.getenv("POLYGON_API_KEY")
 ETHERSCAN_BASE_URL = 'https://api.etherscan.io/api'
 POLYGON_BASE_URL = 'https://api.polygonscan.com/api'
 
+ETHERSCAN_TIMEOUT = 10
+
 CHAINS = {
     "eth": {"url": ETHERSCAN_BASE_URL, "api_key": ETHERSCAN_API_KEY},
     "polygon": {"url": POLYGON_BASE_URL, "api_key": POLYGON_API_KEY}
@@ -25,10 +30,11 @@ def get_token_supply(contract_address, chain="eth"):
         "apikey": CHAINS[chain].get("api_key")
     }
 
-    response = requests.get(CHAINS[chain].get("url"), data=query_params)
-    return response.json()
+    response = SESSION.get(CHAINS[chain].get("url"), params=query_params, timeout=ETHERSCAN_TIMEOUT)
+    return orjson.loads(response.content)
 
 
+@lru_cache(maxsize=512)
 def get_contract_abi(contract_address, chain="eth"):
     query_params = {
         "module": "contract",
@@ -37,5 +43,11 @@ def get_contract_abi(contract_address, chain="eth"):
         "apikey": CHAINS[chain].get("api_key")
     }
 
-    abi = requests.get(CHAINS[chain].get("url"), data=query_params).json().get('result')
-    return abi
+    response = SESSION.get(CHAINS[chain].get("url"), params=query_params, timeout=ETHERSCAN_TIMEOUT)
+    payload = orjson.loads(response.content)
+    # failures (e.g. unverified contracts) come back as status "0" with the reason in result
+    if payload.get('status') != "1":
+        raise ValueError(payload.get('result') or payload.get('message'))
+
+    # etherscan returns the ABI itself as a JSON-encoded string
+    return orjson.loads(payload.get('result'))
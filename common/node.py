@@ -1,19 +1,43 @@
-import json
+import asyncio
 import os
-
+import threading
+from functools import lru_cache, partial
+from itertools import repeat
+from pathlib import Path
+
+import lru
+import orjson
+import websockets
+from aiohttp import ClientError, ClientTimeout
+from cachetools.func import ttl_cache
 from dotenv import load_dotenv
 from ens import ENS
+from eth_abi.exceptions import DecodingError
+from eth_utils import event_abi_to_log_topic, function_abi_to_4byte_selector
 from hexbytes import HexBytes
-from web3 import Web3
-from web3._utils.contracts import find_matching_event_abi
-from web3._utils.events import get_event_data
-from web3._utils.filters import construct_event_filter_params
+from requests.exceptions import Timeout
+from web3 import HTTPProvider, Web3
+from web3._utils.abi import get_abi_output_types
+from web3._utils.caching import generate_cache_key
+from web3._utils.contracts import encode_abi, find_matching_event_abi, find_matching_fn_abi
+from web3._utils.events import construct_event_topic_set, get_event_data
+from web3._utils.method_formatters import get_result_formatters, log_entry_formatter
+from web3._utils.rpc_abi import RPC
+from web3.eth import AsyncEth
+from web3.exceptions import BadFunctionCallOutput, ContractLogicError
+from web3.middleware import geth_poa_middleware
+from web3.middleware.cache import SIMPLE_CACHE_RPC_WHITELIST
+from web3.middleware.geth_poa import geth_poa_cleanup
 
 from .etherscan import get_contract_abi
+from .session import REQUEST_TIMEOUT, SESSION
 
 load_dotenv()
 
-CONTRACTS_STORAGE_PATH = os.path.join(os.getcwd(), "data", "contracts")
+CONTRACTS_STORAGE_PATH = Path(__file__).resolve().parent.parent / "data" / "contracts"
+
+# raw ABI bytes already read from (or written to) CONTRACTS_STORAGE_PATH this run
+_ABI_CACHE = {}
 
 MAINNET_HTTP_PROVIDER_URL = os.getenv("MAINNET_HTTP_PROVIDER_URL")
 MAINNET_WS_PROVIDER_URL = os.getenv("MAINNET_WS_PROVIDER_URL")
@@ -31,30 +55,275 @@ CHAIN_WEBSOCKET_ENDPOINTS = {
     "polygon": POLYGON_WS_PROVIDER_URL
 }
 
+# chains whose blocks carry the longer PoA extraData field
+POA_CHAINS = {"polygon"}
+BLOCK_METHODS = {RPC.eth_getBlockByHash, RPC.eth_getBlockByNumber}
+
+# responses for these are immutable once confirmed (see RPC_CACHE_CONFIRMATIONS), so they can be served from memory
+CACHED_RPC_METHODS = SIMPLE_CACHE_RPC_WHITELIST | {
+    RPC.eth_chainId,
+    RPC.eth_getCode,
+    RPC.eth_getBlockByNumber,
+    RPC.eth_getTransactionByHash,
+    RPC.eth_getTransactionReceipt,
+}
+RPC_CACHE_SIZE = 4096
+BLOCK_TAGS = {"latest", "pending", "earliest", "safe", "finalized"}
+# blocks, transactions and receipts are only cached once they are this deep below the highest block seen
+RPC_CACHE_CONFIRMATIONS = 128
+
+# reverse ENS records rarely change, so resolved names are reused for this many seconds
+ENS_CACHE_TTL = 3600
+
+# eth_getLogs ranges start at LOGS_CHUNK_SIZE blocks, halve on range errors and only grow up to MAX_LOGS_CHUNK_SIZE
+# while no range error has been seen
+LOGS_CHUNK_SIZE = 2000
+MAX_LOGS_CHUNK_SIZE = 10000
+# only node errors mentioning one of these are treated as "range too large" and retried with a smaller chunk
+LOGS_RANGE_ERRORS = ("response size", "query returned more than", "too many", "limit exceeded", "block range",
+                     "timeout", "timed out")
+
+# balanceOfBatch reads are split into windows of this many token ids
+BALANCE_OF_BATCH_WINDOW = 1024
+
+# subscription logs waiting for their handler are buffered up to this many entries
+SUBSCRIPTION_QUEUE_SIZE = 10000
+
+# Multicall3 is deployed at the same address on every supported chain
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+MULTICALL3_ABI = [{
+    "name": "aggregate3",
+    "type": "function",
+    "stateMutability": "payable",
+    "inputs": [{
+        "name": "calls",
+        "type": "tuple[]",
+        "components": [
+            {"name": "target", "type": "address"},
+            {"name": "allowFailure", "type": "bool"},
+            {"name": "callData", "type": "bytes"},
+        ],
+    }],
+    "outputs": [{
+        "name": "returnData",
+        "type": "tuple[]",
+        "components": [
+            {"name": "success", "type": "bool"},
+            {"name": "returnData", "type": "bytes"},
+        ],
+    }],
+}]
+
+
+class OrjsonHTTPProvider(HTTPProvider):
+    def decode_rpc_response(self, raw_response):
+        return orjson.loads(raw_response)
+
+
+def _to_block_number(value):
+    return value if isinstance(value, int) else int(value, 16)
+
+
+# highest block number observed per chain; it never runs ahead of the real tip, so depth checks stay conservative
+_LATEST_BLOCK_SEEN = {}
+
+
+def _observe_block_number(chain, block_number):
+    if block_number is not None:
+        block_number = _to_block_number(block_number)
+        if block_number > _LATEST_BLOCK_SEEN.get(chain, -1):
+            _LATEST_BLOCK_SEEN[chain] = block_number
+
+
+def _is_confirmed(chain, block_number):
+    latest_block = _LATEST_BLOCK_SEEN.get(chain)
+    return latest_block is not None and _to_block_number(block_number) <= latest_block - RPC_CACHE_CONFIRMATIONS
+
+
+def _should_cache_response(chain, method, params, response):
+    if "error" in response or response.get("result") is None:
+        return False
+
+    result = response["result"]
+    if method == RPC.eth_getBlockByNumber:
+        return params[0] not in BLOCK_TAGS and _is_confirmed(chain, params[0])
+    if method == RPC.eth_getCode:
+        return result not in ("0x", b"")
+    if method in (RPC.eth_getTransactionByHash, RPC.eth_getTransactionReceipt):
+        return result.get("blockNumber") is not None and _is_confirmed(chain, result["blockNumber"])
+    return True
+
+
+@lru_cache(maxsize=8)
+def _rpc_cache(chain="eth"):
+    # shared by the client middleware and batch_calls so both read and fill the same responses
+    return lru.LRU(RPC_CACHE_SIZE)
+
+
+def _cached_response(chain, method, params):
+    if method not in CACHED_RPC_METHODS:
+        return None
+    return _rpc_cache(chain).get(generate_cache_key((method, params)))
+
+
+def _cache_response(chain, method, params, response):
+    result = response.get("result")
+    if method == RPC.eth_blockNumber:
+        _observe_block_number(chain, result)
+    elif method in BLOCK_METHODS and result:
+        _observe_block_number(chain, result.get("number"))
 
+    if method in CACHED_RPC_METHODS and _should_cache_response(chain, method, params, response):
+        _rpc_cache(chain)[generate_cache_key((method, params))] = response
+
+
+def construct_rpc_cache_middleware(chain="eth"):
+    def rpc_cache_middleware(make_request, w3):
+        def middleware(method, params):
+            response = _cached_response(chain, method, params)
+            if response is None:
+                response = make_request(method, params)
+                _cache_response(chain, method, params, response)
+            return response
+        return middleware
+    return rpc_cache_middleware
+
+
+@lru_cache(maxsize=8)
 def web3_client(chain="eth", provider="http"):
     if provider and provider == "websocket":
-        return Web3(Web3.WebsocketProvider(CHAIN_WEBSOCKET_ENDPOINTS[chain]))
-    return Web3(Web3.HTTPProvider(CHAIN_ENDPOINTS[chain]))
+        w3 = Web3(Web3.WebsocketProvider(CHAIN_WEBSOCKET_ENDPOINTS[chain]))
+    else:
+        w3 = Web3(OrjsonHTTPProvider(CHAIN_ENDPOINTS[chain], session=SESSION,
+                                     request_kwargs={"timeout": REQUEST_TIMEOUT}))
+
+    if chain in POA_CHAINS:
+        w3.middleware_onion.inject(geth_poa_middleware, layer=0)
+    w3.middleware_onion.add(construct_rpc_cache_middleware(chain))
+    return w3
 
 
+@lru_cache(maxsize=8)
+def async_web3_client(chain="eth"):
+    return Web3(Web3.AsyncHTTPProvider(CHAIN_ENDPOINTS[chain],
+                                       request_kwargs={"timeout": ClientTimeout(REQUEST_TIMEOUT)}),
+                modules={"eth": (AsyncEth,)}, middlewares=[])
+
+
+@lru_cache(maxsize=8)
 def ns_client(chain="eth"):
     return ENS.fromWeb3(web3_client(chain))
 
 
+@lru_cache(maxsize=8)
+def multicall_contract(chain="eth"):
+    return web3_client(chain).eth.contract(address=MULTICALL3_ADDRESS, abi=MULTICALL3_ABI)
+
+
+@lru_cache(maxsize=1024)
+def _fn_abi_candidates(contract, fn_name, num_args):
+    return tuple(abi for abi in contract.abi if abi.get("type") == "function" and abi.get("name") == fn_name
+                 and len(abi.get("inputs", [])) == num_args)
+
+
+def encode_call(contract, fn_name, args):
+    # returns (target, fn_abi, calldata bytes), matching the ABI by name and arity so the arguments are
+    # only validated once
+    candidates = _fn_abi_candidates(contract, fn_name, len(args))
+    if len(candidates) == 1:
+        fn_abi = candidates[0]
+    else:
+        fn_abi = find_matching_fn_abi(contract.abi, contract.web3.codec, fn_name, args)
+
+    calldata = encode_abi(contract.web3, fn_abi, args, function_abi_to_4byte_selector(fn_abi))
+    return contract.address, fn_abi, bytes(HexBytes(calldata))
+
+
+def multicall(calls, chain="eth"):
+    # calls is a list of encode_call results; results keep the same order and reverted calls are None
+    if not calls:
+        return []
+
+    codec = web3_client(chain).codec
+    fn_abis = [fn_abi for target, fn_abi, calldata in calls]
+    aggregated = [(target, True, calldata) for target, fn_abi, calldata in calls]
+
+    results = multicall_contract(chain).functions.aggregate3(aggregated).call()
+
+    decoded = []
+    for fn_abi, (success, return_data) in zip(fn_abis, results):
+        if not success or not return_data:
+            decoded.append(None)
+            continue
+
+        decoded.append(_decode_function_result(codec, fn_abi, return_data))
+
+    return decoded
+
+
+def _decode_function_result(codec, fn_abi, return_data):
+    values = codec.decode_abi(get_abi_output_types(fn_abi), return_data)
+    return values[0] if len(values) == 1 else values
+
+
+def batch_calls(calls, chain="eth"):
+    # calls is a list of (method, params) sent as one JSON-RPC batch; raw results keep the same order.
+    # responses go through the same PoA cleanup and RPC cache as the client middleware
+    if not calls:
+        return []
+
+    responses = [_cached_response(chain, method, params) for method, params in calls]
+    pending = [index for index, response in enumerate(responses) if response is None]
+
+    if pending:
+        payload = [{"jsonrpc": "2.0", "id": index, "method": calls[index][0], "params": calls[index][1]}
+                   for index in pending]
+
+        response = SESSION.post(CHAIN_ENDPOINTS[chain], data=orjson.dumps(payload),
+                                headers={"Content-Type": "application/json"}, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+
+        batch_response = orjson.loads(response.content)
+        if not isinstance(batch_response, list):
+            # nodes that reject the whole batch answer with a single error object
+            raise ValueError(batch_response.get("error", batch_response))
+
+        for rpc_response in batch_response:
+            index = rpc_response["id"]
+            method, params = calls[index]
+            poa_block = chain in POA_CHAINS and method in BLOCK_METHODS
+            if poa_block and rpc_response.get("result") is not None:
+                rpc_response["result"] = geth_poa_cleanup(rpc_response["result"])
+
+            _cache_response(chain, method, params, rpc_response)
+            responses[index] = rpc_response
+
+    results = []
+    for index, rpc_response in enumerate(responses):
+        if rpc_response is None:
+            raise ValueError(f"no response for batched call {index}: {calls[index][0]}")
+        if "error" in rpc_response:
+            raise ValueError(rpc_response["error"])
+        results.append(rpc_response["result"])
+
+    return results
+
+
+@lru_cache(maxsize=4096)
 def checksum_address(address, chain="eth"):
-    return web3_client(chain).toChecksumAddress(address)
+    return Web3.toChecksumAddress(address)
 
 
 def get_balance(address, chain="eth"):
     return web3_client(chain=chain).eth.get_balance(address)
 
 
+@ttl_cache(maxsize=4096, ttl=ENS_CACHE_TTL)
 def get_ens_domain_for_address(address, chain="eth"):
     ens_name = None
     try:
         ens_name = ns_client(chain).name(address)
-    except Exception as e:
+    except (BadFunctionCallOutput, ContractLogicError) as e:
         pass
     return ens_name
 
@@ -63,58 +332,111 @@ def get_current_gas_price(chain="eth"):
     return web3_client(chain).eth.gas_price
 
 
+@lru_cache(maxsize=None)
+def _abi_dir_fd():
+    # opened on first use so importing this module doesn't require the storage directory
+    return os.open(CONTRACTS_STORAGE_PATH, os.O_RDONLY | os.O_DIRECTORY)
+
+
+def _open_abi_file(contract_address, flags):
+    name = f"{contract_address}.abi"
+    if os.open in os.supports_dir_fd:
+        return os.open(name, flags, 0o644, dir_fd=_abi_dir_fd())
+    return os.open(CONTRACTS_STORAGE_PATH / name, flags, 0o644)
+
+
 def fetch_contract_abi(contract_address):
-    path = os.path.join(CONTRACTS_STORAGE_PATH, f"{contract_address}.abi")
-    if os.path.isfile(path):
-        with open(path, "r") as f:
-            return f.read()
+    if contract_address in _ABI_CACHE:
+        return _ABI_CACHE[contract_address]
 
-    return None
+    try:
+        fd = _open_abi_file(contract_address, os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+
+    with os.fdopen(fd, "rb") as f:
+        _ABI_CACHE[contract_address] = f.read()
+    return _ABI_CACHE[contract_address]
 
 
 def store_contract_abi(contract_address, contract_abi):
-    path = os.path.join(CONTRACTS_STORAGE_PATH, f"{contract_address}.abi")
-    if not os.path.isfile(path):
-        with open(path, "x") as f:
-            f.write(contract_abi)
+    if contract_address in _ABI_CACHE:
+        return
+
+    _ABI_CACHE[contract_address] = orjson.dumps(contract_abi)
+    try:
+        fd = _open_abi_file(contract_address, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+    except FileExistsError:
+        return
+
+    with os.fdopen(fd, "wb") as f:
+        f.write(_ABI_CACHE[contract_address])
+
+
+@lru_cache(maxsize=512)
+def _load_abi(contract_address, chain="eth"):
+    contract_abi = fetch_contract_abi(contract_address)
+    if contract_abi:
+        return orjson.loads(contract_abi)
+
+    print(f"fetching contract {contract_address} for the first time")
+    contract_abi = get_contract_abi(contract_address, chain=chain)
+    store_contract_abi(contract_address, contract_abi)
+    return contract_abi
+
+
+@lru_cache(maxsize=1024)
+def _contract_instance(contract_address, chain="eth", provider="http"):
+    return web3_client(chain=chain, provider=provider).eth.contract(address=contract_address,
+                                                                    abi=_load_abi(contract_address, chain=chain))
 
 
 def get_contract(contract_address, chain="eth", provider="http"):
     contract_address = checksum_address(contract_address, chain=chain)
-    contract_abi = fetch_contract_abi(contract_address)
-    if not contract_abi:
-        print(f"fetching contract {contract_address} for the first time")
-        contract_abi = get_contract_abi(contract_address, chain=chain)
-        store_contract_abi(contract_address, contract_abi)
+    return _contract_instance(contract_address, chain=chain, provider=provider)
 
-    contract = web3_client(chain=chain, provider=provider).eth.contract(address=contract_address,
-                                                                        abi=json.loads(contract_abi))
-    return contract
+
+def _to_hexbytes(value):
+    # only HexBytes is passed through: plain bytes.hex() would drop the 0x prefix the RPC params need
+    return value if isinstance(value, HexBytes) else HexBytes(value)
 
 
 def get_transaction(address, chain="eth"):
-    return web3_client(chain).eth.get_transaction(HexBytes(address))
+    return web3_client(chain).eth.get_transaction(_to_hexbytes(address))
 
 
 def get_block(block_number, chain="eth"):
     return web3_client(chain).eth.get_block(block_number)
 
 
+def get_blocks(block_numbers, chain="eth"):
+    calls = [(RPC.eth_getBlockByNumber, [hex(block_number), False]) for block_number in block_numbers]
+    formatter = get_result_formatters(RPC.eth_getBlockByNumber, web3_client(chain).eth)
+    return [formatter(block) for block in batch_calls(calls, chain=chain)]
+
+
 def get_latest_block_number(chain="eth"):
     return web3_client(chain).eth.block_number
 
 
+def get_transactions(transaction_hashes, chain="eth"):
+    calls = [(RPC.eth_getTransactionByHash, [_to_hexbytes(transaction_hash).hex()])
+             for transaction_hash in transaction_hashes]
+    formatter = get_result_formatters(RPC.eth_getTransactionByHash, web3_client(chain).eth)
+    return [formatter(transaction) for transaction in batch_calls(calls, chain=chain)]
+
+
 def get_transaction_receipt(address, chain="eth"):
-    return web3_client(chain).eth.get_transaction_receipt(HexBytes(address))
+    return web3_client(chain).eth.get_transaction_receipt(_to_hexbytes(address))
 
 
 def decode_contract_transaction(transaction_address, chain="eth"):
-    transaction = web3_client(chain).eth.get_transaction(HexBytes(transaction_address))
+    transaction = get_transaction(transaction_address, chain=chain)
 
     contract_address = transaction.get('to')
     print(f"decoding transaction. hash: {transaction_address} | contract: {contract_address}")
 
-    contract = get_contract(contract_address)
+    contract = get_contract(contract_address, chain=chain)
 
     try:
         func_obj, func_params = contract.decode_function_input(transaction.input)
@@ -124,62 +446,154 @@ def decode_contract_transaction(transaction_address, chain="eth"):
         raise e
 
 
+@lru_cache(maxsize=256)
+def _event_meta(contract_address, event_names, chain="eth"):
+    # maps each event's topic0 to its ABI
+    contract = get_contract(contract_address, chain=chain)
+    event_abis = {}
+    for name in event_names:
+        event_abi = find_matching_event_abi(contract.abi, name)
+        event_abis[bytes(event_abi_to_log_topic(event_abi))] = event_abi
+
+    return event_abis
+
+
+def _merge_topics(topic_filters, topics):
+    # caller topics fill positions 1+ on top of what the event names (and token_id) already set
+    if not topics:
+        return topic_filters
+    if topics[0]:
+        raise Exception("topic0 is already set by the event names")
+
+    topic_filters = list(topic_filters)
+    for index, topic in enumerate(topics[1:], start=1):
+        if not topic:
+            continue
+        if index < len(topic_filters) and topic_filters[index] is not None:
+            raise Exception(f"topic{index} is already set by token_id")
+
+        topic_filters.extend([None] * (index + 1 - len(topic_filters)))
+        topic_filters[index] = list(topic) if isinstance(topic, (list, tuple)) else topic
+
+    return topic_filters
+
+
+@lru_cache(maxsize=256)
+def _event_filter_params(contract_address, event_names, token_id=None, topics=None, chain="eth"):
+    # the block range is left out so the same params can be reused across chunks and polls
+    event_abis = _event_meta(contract_address, event_names, chain=chain)
+
+    if len(event_abis) == 1:
+        event_abi, = event_abis.values()
+        argument_filters = {"tokenId": token_id} if token_id else None
+        topic_filters = construct_event_topic_set(event_abi, web3_client(chain).codec, argument_filters)
+    else:
+        if token_id:
+            raise Exception("token_id filtering is only supported for a single event")
+
+        # OR-filter on topic0 so every requested event comes back from the same query
+        topic_filters = [[HexBytes(topic).hex() for topic in event_abis]]
+
+    return {
+        "address": contract_address,
+        "topics": _merge_topics(topic_filters, topics),
+    }
+
+
+def _resolve_block_number(block_identifier, chain="eth"):
+    # eth_getLogs chunking needs concrete block numbers, so tags are resolved up front
+    if isinstance(block_identifier, int):
+        return block_identifier
+    if block_identifier == "earliest":
+        return 0
+    if block_identifier in ("latest", "pending"):
+        return get_latest_block_number(chain=chain)
+    if block_identifier in ("safe", "finalized"):
+        # web3 5.x only knows the older tags, so ask the node directly
+        block = web3_client(chain).manager.request_blocking(RPC.eth_getBlockByNumber, [block_identifier, False])
+        return _to_block_number(block["number"])
+    if isinstance(block_identifier, str) and block_identifier.startswith("0x"):
+        return _to_block_number(block_identifier)
+
+    raise ValueError(f"unsupported block identifier: {block_identifier}")
+
+
+def _is_logs_range_error(error):
+    if isinstance(error, Timeout):
+        return True
+    message = str(error).lower()
+    return any(fragment in message for fragment in LOGS_RANGE_ERRORS)
+
+
 def get_events(contract_address, event_name='Transfer', token_id=None, start_block=0, end_block="latest",
                chain="eth", topics=None):
-    codec = web3_client(chain).codec
+    # event_name can also be a list of names, all fetched through the same eth_getLogs calls
+    w3 = web3_client(chain)
+    codec = w3.codec
     contract_address = checksum_address(contract_address)
-    contract = get_contract(contract_address)
-    event_abi = find_matching_event_abi(contract.abi, event_name)
-
-    argument_filters = {"address": contract_address}
-    if token_id:
-        argument_filters["tokenId"] = token_id
 
+    event_names = (event_name,) if isinstance(event_name, str) else tuple(event_name)
+    event_abis = _event_meta(contract_address, event_names, chain=chain)
+    # the filter params are lru-cached, so OR-lists have to become tuples to be hashable
+    if isinstance(token_id, list):
+        token_id = tuple(token_id)
     if topics:
-        for index, topic in enumerate(topics):
-            if topic:
-                argument_filters[f"topic{index}"] = topic
-
-    if start_block < 0:
-        latest_block = get_latest_block_number(chain=chain)
-        start_block = latest_block + start_block
-
-    data_filter_set, event_filter_params = construct_event_filter_params(
-        event_abi,
-        codec,
-        address=argument_filters.get("address"),
-        argument_filters=argument_filters,
-        fromBlock=start_block,
-        toBlock=end_block
-    )
-
-    print("Querying eth_getLogs with the following parameters:", event_filter_params)
-    logs = web3_client(chain).eth.get_logs(event_filter_params)
+        topics = tuple(tuple(topic) if isinstance(topic, list) else topic for topic in topics)
+    event_filter_params = _event_filter_params(contract_address, event_names, token_id=token_id,
+                                               topics=topics or None, chain=chain)
+
+    if isinstance(start_block, int) and start_block < 0:
+        start_block = get_latest_block_number(chain=chain) + start_block
+
+    start_block = _resolve_block_number(start_block, chain=chain)
+    end_block = _resolve_block_number(end_block, chain=chain)
+
+    # local names keep attribute/global lookups out of the per-log loop
+    decode_event = get_event_data
+    get_logs = w3.eth.get_logs
+
+    # after a range error the chunk never grows back past the size it was retried at, so a node with a fixed
+    # cap isn't re-probed on every other request
+    step = LOGS_CHUNK_SIZE
+    max_step = MAX_LOGS_CHUNK_SIZE
+    chunk_start = start_block
+    while chunk_start <= end_block:
+        chunk_end = min(chunk_start + step - 1, end_block)
+        chunk_filter_params = {**event_filter_params, "fromBlock": chunk_start, "toBlock": chunk_end}
+
+        print("Querying eth_getLogs with the following parameters:", chunk_filter_params)
+        try:
+            logs = get_logs(chunk_filter_params)
+        except (ValueError, Timeout) as e:
+            if step == 1 or not _is_logs_range_error(e):
+                raise e
+            step //= 2
+            max_step = step
+            print(f"eth_getLogs failed ({e}). retrying with {step} blocks per request")
+            continue
 
-    all_events = []
-    for log in logs:
-        evt = get_event_data(codec, event_abi, log)
-        all_events.append(evt)
+        yield from (decode_event(codec, event_abis[bytes(log["topics"][0])], log) for log in logs)
 
-    return all_events
+        chunk_start = chunk_end + 1
+        step = min(step * 2, max_step)
 
 
 def get_receipt_events(transaction_receipt, contract_address, event_name='Transfer', chain="eth"):
     codec = web3_client(chain).codec
-    contract_address = checksum_address(contract_address)
-    contract = get_contract(contract_address)
-    event_abi = find_matching_event_abi(contract.abi, event_name)
+    event_abi, = _event_meta(checksum_address(contract_address), (event_name,), chain=chain).values()
 
     logs = transaction_receipt.logs
 
+    decode_event = get_event_data
     all_events = []
+    append = all_events.append
     for log in logs:
         try:
-            evt = get_event_data(codec, event_abi, log)
+            evt = decode_event(codec, event_abi, log)
         except Exception as e:
             # iterate until finding the correct event
             continue
-        all_events.append(evt)
+        append(evt)
 
     return all_events
 
@@ -187,8 +601,8 @@ def get_receipt_events(transaction_receipt, contract_address, event_name='Transf
 def get_nft_holdings(wallet_address, contract_address, contract_metadata=None):
     wallet_address = checksum_address(wallet_address)
 
-    contract_address = checksum_address(contract_address)
     contract = get_contract(contract_address)
+    contract_address = contract.address
 
     if not contract_metadata:
         raise Exception("kinda need some metadata here")
@@ -204,37 +618,223 @@ def get_nft_holdings(wallet_address, contract_address, contract_metadata=None):
                                     "address": contract_address}}
 
 
+def _is_fetch_batch(contract_metadata):
+    return 'fetch_batch' in contract_metadata and contract_metadata['fetch_batch'] is True
+
+
+def _curated_balance_calls(contract, contract_metadata, wallet_address):
+    if _is_fetch_batch(contract_metadata):
+        # Some NFT projects need some extra love
+        total_supply = contract_metadata.get('total_supply')
+        # each window is encoded straight away so only its calldata outlives the loop iteration
+        calls = []
+        for start in range(0, total_supply, BALANCE_OF_BATCH_WINDOW):
+            token_ids = range(start, min(start + BALANCE_OF_BATCH_WINDOW, total_supply))
+            owners = list(repeat(wallet_address, len(token_ids)))
+            calls.append(encode_call(contract, "balanceOfBatch", [owners, list(token_ids)]))
+        return calls
+
+    return [encode_call(contract, "balanceOf", [wallet_address])]
+
+
+def _curated_balance(contract_address, contract_metadata, results):
+    fetch_batch = _is_fetch_batch(contract_metadata)
+    if any(result is None for result in results):
+        if not fetch_batch:
+            # a plain balanceOf that reverts is an error, not a zero balance
+            raise Exception(f"problems fetching contract balance: {contract_address}")
+        print(f"problems fetching contract balance: {contract_address}. moving along...")
+        return 0
+
+    if fetch_batch:
+        return sum(result.count(1) for result in results)
+    return results[0]
+
+
+def _curated_holding(contract_address, contract_metadata, balance):
+    symbol = contract_metadata.get('symbol')
+    name = contract_metadata.get('name')
+    return {**contract_metadata, **{"balance": balance, "symbol": symbol, "name": name,
+                                    "address": contract_address}}
+
+
+def _curated_batch_balance(contract, contract_metadata, wallet_address):
+    # every fetch_batch contract gets its own aggregate3, so a call that runs out of gas only
+    # costs that contract's balance
+    try:
+        results = multicall(_curated_balance_calls(contract, contract_metadata, wallet_address))
+    except Exception as e:
+        print(f"problems fetching contract balance: {contract.address}. moving along...")
+        return 0
+    return _curated_balance(contract.address, contract_metadata, results)
+
+
 def get_curated_nfts_holdings(wallet_address, include_batch=False, curated_contracts=None):
     if not curated_contracts:
         raise Exception("No curated contracts to check for")
 
     wallet_address = checksum_address(wallet_address)
-    holdings = []
+    candidates = []
+    calls = []
 
     for contract_address, contract_metadata in curated_contracts.items():
-        contract_address = checksum_address(contract_address)
-        contract = get_contract(contract_address)
-        symbol = contract_metadata.get('symbol')
-        name = contract_metadata.get('name')
-
-        if 'fetch_batch' in contract_metadata and contract_metadata['fetch_batch'] is True:
+        if _is_fetch_batch(contract_metadata):
             if not include_batch:
                 continue
 
-            try:
-                # Some NFT projects need some extra love
-                total_supply = contract_metadata.get('total_supply')
-                total = [wallet_address] * total_supply
-                token_ids = list(range(total_supply))
-                balance = contract.functions.balanceOfBatch(total, token_ids).call().count(1)
-            except Exception as e:
-                balance = 0
-                print(f"problems fetching contract balance: {contract_address}. moving along...")
-        else:
-            balance = contract.functions.balanceOf(wallet_address).call()
+            contract = get_contract(contract_address)
+            balance = _curated_batch_balance(contract, contract_metadata, wallet_address)
+            candidates.append((contract.address, contract_metadata, balance, None))
+            continue
+
+        # plain balanceOf calls are cheap, so they all share a single aggregate3
+        contract = get_contract(contract_address)
+        candidates.append((contract.address, contract_metadata, None, len(calls)))
+        calls.extend(_curated_balance_calls(contract, contract_metadata, wallet_address))
+
+    results = multicall(calls)
 
+    holdings = []
+    for contract_address, contract_metadata, balance, index in candidates:
+        if index is not None:
+            balance = _curated_balance(contract_address, contract_metadata, results[index:index + 1])
         if balance > 0:
-            holdings.append({**contract_metadata, **{"balance": balance, "symbol": symbol, "name": name,
-                                                     "address": contract_address}})
+            holdings.append(_curated_holding(contract_address, contract_metadata, balance))
 
     return holdings
+
+
+async def aget_balance(address, chain="eth"):
+    return await async_web3_client(chain).eth.get_balance(address)
+
+
+async def aget_contract(contract_address, chain="eth", provider="http"):
+    # building a contract may hit Etherscan and the disk, so keep it off the event loop
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, partial(get_contract, contract_address, chain=chain,
+                                                    provider=provider))
+
+
+async def acall(contract, fn_name, args, chain="eth"):
+    return await _acall_encoded(*encode_call(contract, fn_name, args), chain=chain)
+
+
+async def _acall_encoded(target, fn_abi, calldata, chain="eth"):
+    # like multicall, an empty result (e.g. an address without code) comes back as None
+    w3 = async_web3_client(chain)
+    return_data = await w3.eth.call({"to": target, "data": HexBytes(calldata).hex()})
+    if not return_data:
+        return None
+    return _decode_function_result(w3.codec, fn_abi, return_data)
+
+
+async def aget_curated_nfts_holdings(wallet_address, include_batch=False, curated_contracts=None):
+    if not curated_contracts:
+        raise Exception("No curated contracts to check for")
+
+    wallet_address = checksum_address(wallet_address)
+
+    async def _call_or_none(target, fn_abi, calldata):
+        # errors stay per call, so one bad contract doesn't fail the whole gather
+        try:
+            return await _acall_encoded(target, fn_abi, calldata)
+        except (ValueError, DecodingError, ClientError, asyncio.TimeoutError) as e:
+            return None
+
+    async def _fetch_one(contract_address, contract_metadata):
+        contract = await aget_contract(contract_address)
+        contract_address = contract.address
+
+        try:
+            contract_calls = _curated_balance_calls(contract, contract_metadata, wallet_address)
+        except Exception as e:
+            print(f"problems fetching contract balance: {contract_address}. moving along...")
+            return None
+
+        results = await asyncio.gather(*[_call_or_none(*call) for call in contract_calls])
+        balance = _curated_balance(contract_address, contract_metadata, results)
+        if balance > 0:
+            return _curated_holding(contract_address, contract_metadata, balance)
+        return None
+
+    holdings = await asyncio.gather(*[_fetch_one(contract_address, contract_metadata)
+                                      for contract_address, contract_metadata in curated_contracts.items()
+                                      if include_batch or not _is_fetch_batch(contract_metadata)])
+    return [holding for holding in holdings if holding]
+
+
+async def asubscribe_events(contract_address, event_name, handler, chain="eth"):
+    # streams new logs over eth_subscribe and calls handler (sync or async) with every decoded event
+    contract_address = checksum_address(contract_address)
+    event_names = (event_name,) if isinstance(event_name, str) else tuple(event_name)
+
+    # resolving the ABI may hit Etherscan and the disk, so keep it off the event loop
+    loop = asyncio.get_running_loop()
+    event_abis = await loop.run_in_executor(None, partial(_event_meta, contract_address, event_names, chain=chain))
+    event_filter_params = await loop.run_in_executor(None, partial(_event_filter_params, contract_address,
+                                                                   event_names, chain=chain))
+    codec = web3_client(chain).codec
+
+    # a bounded buffer between the socket and the handler so slow handlers don't drop events
+    queue = asyncio.Queue(maxsize=SUBSCRIPTION_QUEUE_SIZE)
+
+    async def _consume():
+        while True:
+            log = log_entry_formatter(await queue.get())
+            try:
+                event_abi = event_abis.get(bytes(log["topics"][0])) if log["topics"] else None
+                if event_abi is None:
+                    print(f"skipping log with unexpected topics: {log['topics']}")
+                    continue
+
+                result = handler(get_event_data(codec, event_abi, log))
+                if asyncio.iscoroutine(result):
+                    await result
+            finally:
+                queue.task_done()
+
+    async def _read(ws):
+        async for message in ws:
+            payload = orjson.loads(message)
+            if payload.get("method") != "eth_subscription":
+                continue
+
+            log = payload["params"]["result"]
+            # logs dropped by a reorg are re-sent with removed set, skip them
+            if log.get("removed"):
+                continue
+            await queue.put(log)
+
+    async with websockets.connect(CHAIN_WEBSOCKET_ENDPOINTS[chain]) as ws:
+        await ws.send(orjson.dumps({"jsonrpc": "2.0", "id": 1, "method": "eth_subscribe",
+                                    "params": ["logs", event_filter_params]}).decode())
+        response = orjson.loads(await ws.recv())
+        if "error" in response:
+            raise ValueError(response["error"])
+
+        consumer = asyncio.ensure_future(_consume())
+        reader = asyncio.ensure_future(_read(ws))
+        try:
+            # the consumer only ever finishes by failing, so whichever task ends first decides what happens
+            await asyncio.wait({consumer, reader}, return_when=asyncio.FIRST_COMPLETED)
+            if not consumer.done():
+                # re-raises socket errors; on a clean close, hand what's still queued to the handler first
+                reader.result()
+                drained = asyncio.ensure_future(queue.join())
+                await asyncio.wait({consumer, drained}, return_when=asyncio.FIRST_COMPLETED)
+                drained.cancel()
+
+            if consumer.done():
+                consumer.result()
+        finally:
+            reader.cancel()
+            consumer.cancel()
+
+
+def subscribe_events(contract_address, event_name, handler, chain="eth"):
+    # runs asubscribe_events on its own event loop in a background thread
+    thread = threading.Thread(target=asyncio.run,
+                              args=(asubscribe_events(contract_address, event_name, handler, chain=chain),),
+                              daemon=True)
+    thread.start()
+    return thread